@@ -1,12 +1,26 @@
 import re
 import os
+
+# Tesseract's OpenMP threading is slower than single-threaded OCR when the
+# server is already handling requests in parallel, so turn it off by default.
+# Set before any third-party import, since OpenMP reads it once when it loads
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+import asyncio
+import io
+import hashlib
+import queue
+import threading
+import time
+from contextlib import asynccontextmanager
+from collections import OrderedDict
 import spacy
-import shutil
-import tempfile
 from PIL import Image
-import pytesseract
-from fuzzywuzzy import fuzz
-from typing import Dict
+from tesserocr import PyTessBaseAPI, OEM, PSM
+from rapidfuzz import fuzz, utils
+from typing import Dict, Optional
+from spacy.language import Language
+from spacy.tokens import Doc
 import fitz  
 
 # --- FastAPI Imports ---
@@ -14,15 +28,54 @@ from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 
 # --- Load AI Model ---
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Spacy model 'en_core_web_sm' not found.")
-    print("Please run: python -m spacy download en_core_web_sm")
-    exit()
+# Loaded in the app's startup hook rather than at import, so it happens once
+# per serving worker and not in the uvicorn supervisor or on spawn re-imports
+nlp: Optional[Language] = None
+
+def load_nlp() -> None:
+    global nlp
+    # Only the NER output (doc.ents) is used, so don't load the other pipeline
+    # components. NER has its own internal tok2vec in the small model; the
+    # shared one only feeds the tagger and parser
+    try:
+        nlp = spacy.load(
+            "en_core_web_sm",
+            exclude=["tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer"],
+        )
+    except OSError:
+        print("Spacy model 'en_core_web_sm' not found.")
+        print("Please run: python -m spacy download en_core_web_sm")
+        exit()
+
+    # Run one document through the pipeline so lazy initialization happens
+    # at startup instead of on the first user request. The sample contains a
+    # name and a date, so it also checks NER still works without the other
+    # components
+    warmup_doc = nlp("Rahul Sharma was born on 12 March 1990 in New Delhi.")
+    if not warmup_doc.ents:
+        print("Warning: spaCy NER found no entities in the warm-up sentence.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_nlp()
+    yield
+
+# --- Regex Patterns ---
+# PAN, Aadhar and DOB are matched together so the text is scanned only once
+KYC_PATTERN = re.compile(
+    r'(?P<pan_number>[A-Z]{5}[0-9]{4}[A-Z]{1})'
+    r'|(?P<aadhar_number>[2-9]{1}[0-9]{3}\s[0-9]{4}\s[0-9]{4})'
+    r'|(?P<dob>\d{2}[/-]\d{2}[/-]\d{4})'
+)
+
+# Labels used to locate the name when NER doesn't find one.
+# "fafa" is how Tesseract reads the Hindi DOB label on Aadhar cards
+NAME_ANCHORS = ("Name", "NAME")
+DOB_ANCHORS = ("DOB", "fafa", "Year of Birth")
+ANCHOR_PATTERN = re.compile("|".join(map(re.escape, NAME_ANCHORS + DOB_ANCHORS)))
 
 # --- Initialize FastAPI App ---
-app = FastAPI(title="Smart KYC Checker API")
+app = FastAPI(title="Smart KYC Checker API", lifespan=lifespan)
 
 # --- Add CORS Middleware ---
 app.add_middleware(
@@ -33,80 +86,220 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Set KYC_DEBUG=1 (or true/yes) to include the raw extracted text in API
+# responses. Any other value, including 0/false, leaves it off
+DEBUG_RAW_TEXT = os.getenv("KYC_DEBUG", "").lower() in ("1", "true", "yes")
+
+# --- OCR Settings ---
+# Tesseract accuracy plateaus around this size while runtime keeps growing
+# with pixel count, so larger uploaded images are downscaled first
+MAX_OCR_SIDE = 1600
+# Pages with less text than this are treated as scanned and sent to OCR
+MIN_PDF_PAGE_TEXT = 20
+# KYC documents are one or two pages, so at most this many pages of a PDF
+# are OCR'd. Stops a long scanned upload from holding a Tesseract instance
+MAX_OCR_PAGES = 2
+PDF_OCR_DPI = 200
+# Ligatures are left out of the flags so MuPDF expands them (e.g. "ﬁ" -> "fi"),
+# letting names and IDs match as plain text
+PDF_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+
+# Number of extracted texts kept in memory, keyed by upload content hash.
+# Entries expire after TEXT_CACHE_TTL seconds so personal data from KYC
+# documents isn't held indefinitely
+TEXT_CACHE_SIZE = 1024
+TEXT_CACHE_TTL = 3600
+text_cache = OrderedDict()
+text_cache_lock = threading.Lock()
+
+# Tesseract API objects aren't thread-safe, so OCR borrows one from a small
+# pool. One per document that can be OCR'd at the same time, created lazily,
+# each keeping its language model loaded across calls
+TESS_POOL_SIZE = 2
+tess_pool = queue.Queue()
+tess_created = 0
+tess_pool_lock = threading.Lock()
+
 # --- Logic---
-def extract_text_from_file(file_path: str, content_type: str) -> str:
+def acquire_tess_api() -> PyTessBaseAPI:
+    global tess_created
+    try:
+        return tess_pool.get_nowait()
+    except queue.Empty:
+        pass
+    with tess_pool_lock:
+        if tess_created < TESS_POOL_SIZE:
+            # LSTM engine, treat the image as a single uniform block of text
+            api = PyTessBaseAPI(lang="eng", oem=OEM.LSTM_ONLY, psm=PSM.SINGLE_BLOCK)
+            tess_created += 1
+            return api
+    # Pool is full, wait for another thread to hand one back
+    return tess_pool.get()
+
+def ocr_image(img: Image.Image) -> str:
+    api = acquire_tess_api()
+    try:
+        api.SetImage(img)
+        return api.GetUTF8Text()
+    finally:
+        # Drop the document image so it isn't kept in memory while pooled
+        api.Clear()
+        tess_pool.put(api)
+
+def extract_text_from_file(data: bytes, content_type: str) -> str:
     text = ""
     try:
         if content_type in ["image/jpeg", "image/png", "image/jpg"]:
             # Use Tesseract for images
-            img = Image.open(file_path)
-            text = pytesseract.image_to_string(img)
+            img = Image.open(io.BytesIO(data))
+            if max(img.size) > MAX_OCR_SIDE:
+                img.thumbnail((MAX_OCR_SIDE, MAX_OCR_SIDE))
+            # Flatten transparency onto white first, otherwise transparent
+            # pixels (usually stored as black) hide dark text
+            if img.mode == "P" and "transparency" in img.info:
+                img = img.convert("RGBA")
+            if "A" in img.getbands():
+                background = Image.new("RGB", img.size, "white")
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            # Tesseract works on grayscale anyway, so convert before handing it over
+            text = ocr_image(img.convert("L"))
             
         elif content_type == "application/pdf":
             # Use PyMuPDF (fitz) for PDFs
-            with fitz.open(file_path) as doc:
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                parts = []
+                ocr_pages = 0
                 for page in doc:
-                    text += page.get_text()
+                    page_text = page.get_text("text", flags=PDF_TEXT_FLAGS)
+                    # No usable text layer (scanned PDF), fall back to OCR
+                    if len(page_text.strip()) < MIN_PDF_PAGE_TEXT and ocr_pages < MAX_OCR_PAGES:
+                        ocr_pages += 1
+                        # Rendered straight to grayscale at OCR resolution,
+                        # so no resize or conversion is needed afterwards
+                        pix = page.get_pixmap(dpi=PDF_OCR_DPI, colorspace=fitz.csGRAY)
+                        img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+                        page_text = ocr_image(img)
+                    parts.append(page_text)
+                text = "".join(parts)
         else:
             print(f"Unsupported file type: {content_type}")
             return ""
             
         return text
     except Exception as e:
-        print(f"Error processing file {file_path} (type: {content_type}): {e}")
+        print(f"Error processing file (type: {content_type}): {e}")
         return ""
 
-def extract_smart(text: str) -> dict:
+def extract_text_cached(data: bytes, content_type: str) -> str:
+    # Re-uploads of the same file (retries, app resends) skip OCR entirely
+    key = (hashlib.blake2b(data, digest_size=16).digest(), content_type)
+    with text_cache_lock:
+        entry = text_cache.get(key)
+        if entry is not None:
+            stored_at, text = entry
+            if time.monotonic() - stored_at < TEXT_CACHE_TTL:
+                text_cache.move_to_end(key)
+                return text
+            del text_cache[key]
 
-    if not text:
-        return {}
-        
-    doc = nlp(text)
+    text = extract_text_from_file(data, content_type)
+
+    # Don't cache failures so the file is retried next time
+    if text:
+        with text_cache_lock:
+            text_cache[key] = (time.monotonic(), text)
+            text_cache.move_to_end(key)
+            if len(text_cache) > TEXT_CACHE_SIZE:
+                text_cache.popitem(last=False)
+    return text
+
+def next_nonempty_line(text: str, pos: int) -> Optional[str]:
+    # First non-blank line starting at pos
+    while pos < len(text):
+        end = text.find('\n', pos)
+        if end == -1:
+            end = len(text)
+        line = text[pos:end].strip()
+        if line:
+            return line
+        pos = end + 1
+    return None
+
+def prev_nonempty_line(text: str, pos: int) -> Optional[str]:
+    # Last non-blank line ending before pos
+    while pos > 0:
+        start = text.rfind('\n', 0, pos - 1) + 1
+        line = text[start:pos].strip()
+        if line:
+            return line
+        pos = start
+    return None
+
+def find_name_near_anchors(text: str) -> Optional[str]:
+    # Only lines containing an anchor are looked at, so the text is never
+    # split into a list of lines
+    pos = 0
+    for match in ANCHOR_PATTERN.finditer(text):
+        hit = match.start()
+        # Another anchor on a line that was already checked
+        if hit < pos:
+            continue
+        line_start = text.rfind('\n', 0, hit) + 1
+        line_end = text.find('\n', hit)
+        if line_end == -1:
+            line_end = len(text)
+        line = text[line_start:line_end]
+
+        # Heuristic 1: Line after "Name" (for PAN)
+        if any(a in line for a in NAME_ANCHORS):
+            next_line = next_nonempty_line(text, line_end + 1)
+            if next_line:
+                return next_line
+
+        # Heuristic 2: Line before "DOB" (for Aadhar)
+        if any(a in line for a in DOB_ANCHORS):
+            prev_line = prev_nonempty_line(text, line_start)
+            # Check if the previous line is a plausible name
+            if prev_line and 1 < len(prev_line.split()) < 4 and not any(char.isdigit() for char in prev_line):
+                return prev_line
+
+        pos = line_end + 1
+
+    return None
+
+def extract_smart_from_doc(doc: Doc) -> dict:
+
+    text = doc.text
     details = {}
 
-    # 1. Regex for IDs 
-    pan_pattern = re.compile(r'[A-Z]{5}[0-9]{4}[A-Z]{1}')
-    pan_match = pan_pattern.search(text)
-    details["pan_number"] = pan_match.group(0) if pan_match else None
-    
-    aadhar_pattern = re.compile(r'[2-9]{1}[0-9]{3}\s[0-9]{4}\s[0-9]{4}')
-    aadhar_match = aadhar_pattern.search(text)
-    details["aadhar_number"] = aadhar_match.group(0) if aadhar_match else None
+    # 1. Regex for IDs and DOB (first match of each kind wins).
+    #    Dates are matched over the whole text instead of per DATE entity,
+    #    so we don't depend on NER getting the entity boundaries right
+    regex_details = {"pan_number": None, "aadhar_number": None, "dob": None}
+    for match in KYC_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if regex_details[kind] is None:
+            regex_details[kind] = match.group(0)
+            if all(regex_details.values()):
+                break
+    details.update(regex_details)
 
-    # 2. NER for Names and Dates 
+    # 2. NER for Names (only the first multi-word PERSON is used)
     name_candidates = []
-    dob_candidates = []
     
     for ent in doc.ents:
-        if ent.label_ == "PERSON":
-            if len(ent.text.split()) > 1:
-                name_candidates.append(ent.text.strip().replace('\n', ' '))
-                
-        elif ent.label_ == "DATE":
-            match = re.search(r'(\d{2}/\d{2}/\d{4}|\d{2}-\d{2}-\d{4})', ent.text)
-            if match:
-                dob_candidates.append(match.group(0))
+        if ent.label_ == "PERSON" and len(ent.text.split()) > 1:
+            name_candidates.append(ent.text.strip().replace('\n', ' '))
+            break
     
     # 3. Improved Fallback Heuristic 
     if not name_candidates:
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        for i, line in enumerate(lines):
-            
-            # Heuristic 1: Line after "Name" (for PAN)
-            if ("Name" in line or "NAME" in line) and i + 1 < len(lines):
-                name_candidates.append(lines[i+1])
-                break # Found it
-            
-            # Heuristic 2: Line before "DOB" (for Aadhar)
-            if ("DOB" in line or "fafa" in line) and i - 1 >= 0:
-                prev_line = lines[i-1]
-                # Check if the previous line is a plausible name
-                if 1 < len(prev_line.split()) < 4 and not any(char.isdigit() for char in prev_line):
-                    name_candidates.append(prev_line)
-                    break # Found it
+        fallback_name = find_name_near_anchors(text)
+        if fallback_name:
+            name_candidates.append(fallback_name)
                 
     details["name"] = name_candidates[0] if name_candidates else None
-    details["dob"] = dob_candidates[0] if dob_candidates else None
     
     return details
 
@@ -128,7 +321,15 @@ def check_for_fraud_api(doc1_details: dict, doc2_details: dict) -> dict:
     report["name_check"]["doc2"] = name2
 
     if name1 and name2:
-        similarity = fuzz.token_sort_ratio(name1.lower(), name2.lower())
+        # Normalize once up front (lowercase, strip punctuation, sort tokens).
+        # Identical names skip the comparison entirely, and since the tokens
+        # are already sorted a plain ratio gives the token_sort_ratio score
+        norm1 = " ".join(sorted(utils.default_process(name1).split()))
+        norm2 = " ".join(sorted(utils.default_process(name2).split()))
+        if norm1 == norm2:
+            similarity = 100
+        else:
+            similarity = round(fuzz.ratio(norm1, norm2))
         report["name_check"]["similarity"] = similarity
         if similarity < 80:  # 80% similarity threshold
             issues_found = True
@@ -170,28 +371,26 @@ async def create_kyc_check(doc1: UploadFile = File(...), doc2: UploadFile = File
     """
     The main API endpoint.
     1. Receives two uploaded files (images or PDFs).
-    2. Saves them to temporary files.
+    2. Reads them into memory.
     3. Runs text extraction (OCR or PDF parse).
     4. Runs fraud check.
-    5. Cleans up files and returns the report.
+    5. Returns the report.
     """
-    temp_dir = tempfile.mkdtemp()
-    doc1_path = os.path.join(temp_dir, doc1.filename)
-    doc2_path = os.path.join(temp_dir, doc2.filename)
-
     try:
-        # Save files temporarily
-        with open(doc1_path, "wb") as buffer:
-            shutil.copyfileobj(doc1.file, buffer)
-        with open(doc2_path, "wb") as buffer:
-            shutil.copyfileobj(doc2.file, buffer)
+        # Read the uploads into memory (no temp files needed)
+        doc1_data = await doc1.read()
+        doc2_data = await doc2.read()
 
         # --- Run KYC Pipeline ---
         
         # 1. Extract text (MODIFIED)
-        #    We now pass the content_type to our new function
-        doc1_text = extract_text_from_file(doc1_path, doc1.content_type)
-        doc2_text = extract_text_from_file(doc2_path, doc2.content_type)
+        #    We now pass the content_type to our new function.
+        #    Both files are processed concurrently in worker threads
+        #    so OCR doesn't block the event loop.
+        doc1_text, doc2_text = await asyncio.gather(
+            asyncio.to_thread(extract_text_cached, doc1_data, doc1.content_type),
+            asyncio.to_thread(extract_text_cached, doc2_data, doc2.content_type),
+        )
         
         if not doc1_text or not doc2_text:
             raise HTTPException(
@@ -200,8 +399,10 @@ async def create_kyc_check(doc1: UploadFile = File(...), doc2: UploadFile = File
             )
 
         # 2. Extract details
-        doc1_details = extract_smart(doc1_text)
-        doc2_details = extract_smart(doc2_text)
+        #    Both texts go through spaCy in a single batch
+        nlp_doc1, nlp_doc2 = nlp.pipe([doc1_text, doc2_text], batch_size=2)
+        doc1_details = extract_smart_from_doc(nlp_doc1)
+        doc2_details = extract_smart_from_doc(nlp_doc2)
 
         # 3. Perform fraud check
         report = check_for_fraud_api(doc1_details, doc2_details)
@@ -212,11 +413,12 @@ async def create_kyc_check(doc1: UploadFile = File(...), doc2: UploadFile = File
             "doc2": doc2_details,
         }
         
-        # Add the raw extracted text to the report
-        report["debug_raw_text"] = {
-            "doc1": doc1_text,
-            "doc2": doc2_text
-        }
+        # Add the raw extracted text to the report (debug mode only)
+        if DEBUG_RAW_TEXT:
+            report["debug_raw_text"] = {
+                "doc1": doc1_text,
+                "doc2": doc2_text
+            }
         
         return report
 
@@ -224,14 +426,6 @@ async def create_kyc_check(doc1: UploadFile = File(...), doc2: UploadFile = File
         # Catch any other unexpected errors
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
     finally:
-        # Clean up: Always remove the temp files and directory
-        if os.path.exists(doc1_path):
-            os.remove(doc1_path)
-        if os.path.exists(doc2_path):
-            os.remove(doc2_path)
-        if os.path.exists(temp_dir):
-            os.rmdir(temp_dir)
-        
         await doc1.close()
         await doc2.close()
 
@@ -242,4 +436,12 @@ def read_root():
 # --- To run the server ---
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    # One worker process per core since OCR is CPU-bound (each worker
+    # loads its own copy of the model). Needs the "main:app" import string.
+    # uvicorn picks uvloop/httptools automatically when they're installed.
+    uvicorn.run(
+        "main:app",
+        host="127.0.0.1",
+        port=8000,
+        workers=os.cpu_count(),
+    )
\ No newline at end of file